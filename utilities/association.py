@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+"""
+association of duplicate events across catalogs.
+
+events of different sources are the same earthquake when they are
+within max_dt seconds, max_distance km (distance.distance) and max_dmag
+magnitude units of each other. candidates are found with a merge join
+on the time-sorted catalog: event i is only compared to its successors
+i + 1, i + 2, ... while they are within max_dt, so the work is linear
+in the number of events plus the number of pairs within max_dt.
+
+candidates are then grouped greedily, closest first, such that a group
+holds at most one event per source. the preferred event of a group is
+the one from the source listed first in priority.
+
+"""
+
+import numpy as np
+import pandas as pd
+from utilities import kernels
+
+
+def _candidate_pairs(times, sources, lons, lats, depths, mags, max_dt, max_distance, max_dmag):
+    """
+    returns (first, second, score) of event pairs of different sources
+    within the tolerances, score being the squared separation in units
+    of the tolerances
+
+    times must be sorted ascending.
+    """
+    n = times.shape[0]
+    max_dt_ns = max(int(max_dt * 1e9), 1)
+    firsts, seconds, scores = [], [], []
+    # events whose k-th successor is still within max_dt
+    active = np.arange(n - 1)
+    k = 1
+    while active.shape[0] > 0:
+        second = active + k
+        dt = times[second] - times[active]
+        within = dt <= max_dt_ns
+        active = active[within]
+        first = active
+        second = second[within]
+        dt = dt[within]
+        k += 1
+        active = active[active + k < n]
+
+        near = sources[first] != sources[second]
+        if max_dmag is not None:
+            near &= np.abs(mags[first] - mags[second]) <= max_dmag
+        first = first[near]
+        second = second[near]
+        dt = dt[near]
+
+        # a missing depth takes the depth of the other event
+        depth_a = np.where(np.isnan(depths[first]), depths[second], depths[first])
+        depth_b = np.where(np.isnan(depths[second]), depths[first], depths[second])
+        dr = kernels.hypocentral_distance(lons[first], lats[first], np.nan_to_num(depth_a)
+                                          , lons[second], lats[second], np.nan_to_num(depth_b))
+        near = dr <= max_distance
+        firsts.append(first[near])
+        seconds.append(second[near])
+        scores.append((dt[near] / float(max_dt_ns)) ** 2 + (dr[near] / max_distance) ** 2)
+
+    if len(firsts) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+    return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(scores)
+
+
+def _group_pairs(n_events, sources, first, second, scores):
+    """
+    returns a group label per event, merging the groups of candidate
+    pairs closest first as long as no source appears twice in a group
+    """
+    parent = np.arange(n_events)
+    members = {}
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for pair in np.argsort(scores, kind='mergesort'):
+        a = find(first[pair])
+        b = find(second[pair])
+        if a == b:
+            continue
+        sources_a = members.get(a, {sources[a]})
+        sources_b = members.get(b, {sources[b]})
+        if sources_a & sources_b:
+            continue
+        if len(sources_a) < len(sources_b):
+            a, b = b, a
+            sources_a, sources_b = sources_b, sources_a
+        parent[b] = a
+        members[a] = sources_a | sources_b
+        members.pop(b, None)
+
+    # pointer jumping resolves the remaining chains to their roots
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def associate_events(df, max_dt=16., max_distance=100., max_dmag=None, priority=None):
+    """
+    labels duplicate events of a multi-source catalog
+
+    df needs a timestamp index and lon, lat, depth, mag and source
+    columns, as returned by import_export.import_catalogs. the result
+    is sorted by time and has two more columns: event_group, equal for
+    events associated as one earthquake, and preferred, true for the
+    event of every group whose source comes first in priority (sources
+    not in priority rank last, in order of appearance).
+
+    df : pandas.DataFrame
+    max_dt : float, seconds
+    max_distance : float, km
+    max_dmag : float
+    priority : list of source names
+    return : pandas.DataFrame
+    """
+    df = df.sort_index(kind='mergesort')
+    times = np.asarray(df.index).astype('datetime64[ns]').view(np.int64)
+    source_names = list(priority or []) + [s for s in pd.unique(df['source']) if s not in (priority or [])]
+    ranks = {name: rank for rank, name in enumerate(source_names)}
+    sources = df['source'].map(ranks).values.astype(np.int64)
+
+    first, second, scores = _candidate_pairs(times, sources
+                                             , df['lon'].values.astype(np.float64)
+                                             , df['lat'].values.astype(np.float64)
+                                             , df['depth'].values.astype(np.float64)
+                                             , df['mag'].values.astype(np.float64)
+                                             , max_dt, max_distance, max_dmag)
+    groups = _group_pairs(times.shape[0], sources, first, second, scores)
+
+    order = np.lexsort((sources, groups))
+    preferred = np.zeros(times.shape[0], dtype=bool)
+    preferred[order[np.r_[True, groups[order][1:] != groups[order][:-1]]]] = True
+    return df.assign(event_group=groups, preferred=preferred)
+
+
+def merge_catalogs(df, max_dt=16., max_distance=100., max_dmag=None, priority=None, mag_priority=None):
+    """
+    returns one event per earthquake of a multi-source catalog
+
+    every earthquake keeps the event of its preferred source (see
+    associate_events). with mag_priority its magnitude is taken from
+    the first source of mag_priority that reported the event instead.
+
+    df : pandas.DataFrame
+    max_dt : float, seconds
+    max_distance : float, km
+    max_dmag : float
+    priority : list of source names
+    mag_priority : list of source names
+    return : pandas.DataFrame
+    """
+    associated = associate_events(df, max_dt=max_dt, max_distance=max_distance
+                                  , max_dmag=max_dmag, priority=priority)
+    merged = associated[associated['preferred'].values]
+
+    if mag_priority is not None:
+        ranks = {name: rank for rank, name in enumerate(mag_priority)}
+        mag_ranks = associated['source'].map(ranks).fillna(len(mag_priority)).values
+        groups = associated['event_group'].values
+        order = np.lexsort((mag_ranks, groups))
+        first = order[np.r_[True, groups[order][1:] != groups[order][:-1]]]
+        mags = pd.Series(associated['mag'].values[first], index=groups[first])
+        merged = merged.assign(mag=mags.loc[merged['event_group'].values].values)
+
+    return merged.drop('preferred', axis=1)
@@ -1,3 +1,5 @@
+import numpy as np
+from utilities import kernels
 
 def shoot(lon, lat, azimuth, maxdist=None):
     """Shooter Function
@@ -86,14 +88,9 @@ def equi(ax, m, centerlon, centerlat, radius, *args, **kwargs):
     """
     glon1 = centerlon
     glat1 = centerlat
-    X = []
-    Y = []
-    for azimuth in range(0, 360):
-        glon2, glat2, baz = shoot(glon1, glat1, azimuth, radius)
-        X.append(glon2)
-        Y.append(glat2)
-    X.append(X[0])
-    Y.append(Y[0])
+    X, Y, baz = kernels.direct_geodesic(glon1, glat1, np.arange(0, 360), radius)
+    X = list(X) + [X[0]]
+    Y = list(Y) + [Y[0]]
  
     X,Y = m(X,Y)
     ax.plot(X,Y,**kwargs)
@@ -168,16 +165,17 @@ def plot_seismicity_map(dataframe, lon_lat_min_max=None, **kwargs):
     Fails on catalogs with >1 million events
     (perhaps smaller).
     
-    dataframe : pandas.DataFrame
+    dataframe : pandas.DataFrame or catalog.Catalog
     lon_lat_min_max : list
     kwargs : figure axes kwargs
     """
-    df = dataframe.copy()
+    lons = np.asarray(dataframe.lon)
+    lats = np.asarray(dataframe.lat)
     if lon_lat_min_max is None:
-        lat_min = np.floor(df.lat.min())
-        lat_max = np.ceil(df.lat.max())
-        lon_min = np.floor(df.lon.min())
-        lon_max = np.ceil(df.lon.max())
+        lat_min = np.floor(lats.min())
+        lat_max = np.ceil(lats.max())
+        lon_min = np.floor(lons.min())
+        lon_max = np.ceil(lons.max())
     else:
         lon_min, lon_max, lat_min, lat_max = lon_lat_min_max
 
@@ -200,9 +198,9 @@ def plot_seismicity_map(dataframe, lon_lat_min_max=None, **kwargs):
     m.drawcoastlines()
     m.fillcontinents(color='0.72', zorder=0)
     
-    x, y = m(df.lon.values, df.lat.values)
+    x, y = m(lons, lats)
     # TODO : make the color user changeable
-    cbar = ax.scatter(x, y, c=df.depth.values, s=1*np.exp(df.mag.values/2.), edgecolor='None'
+    cbar = ax.scatter(x, y, c=np.asarray(dataframe.depth), s=1*np.exp(np.asarray(dataframe.mag)/2.), edgecolor='None'
                   , cmap='rainbow', alpha=0.5, vmin=0, vmax=100)
     c1 = fig.colorbar(cbar, label='depth (km)',fraction=0.0346, pad=0.084)
     c1.ax.invert_yaxis()
@@ -0,0 +1,212 @@
+# -*- encoding: utf-8 -*-
+"""
+on-disk memoization of expensive catalog computations.
+
+results are stored as compressed numpy archives (.npz) named by a
+content hash of the catalog arrays and the function parameters. the
+cache directory is kept under a size budget by evicting the least
+recently used entries. writes go to a temporary file that is atomically
+renamed into place, so parallel workers can share one cache directory.
+
+the directory is only scanned when a store is estimated to push it over
+the budget, and then evicted down to EVICTION_TARGET of it, so storing
+many small entries stays cheap. with parallel writers every process
+only counts its own stores between scans, which makes the budget a
+soft limit.
+
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+#: default size budget of a cache directory in bytes.
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+#: file extension of cache entries.
+EXTENSION = '.npz'
+
+#: fraction of the budget a store over budget evicts down to, leaving
+#: room for the following stores before the next scan.
+EVICTION_TARGET = 0.9
+
+#: estimated size in bytes of every cache directory stored to.
+_directory_sizes = {}
+
+
+def _update_hash(hasher, values):
+    """
+    feeds the raw bytes of an array into a hashlib object
+
+    datetime arrays are hashed as int64 nanoseconds and object
+    arrays by the string representation of their items.
+
+    hasher : hashlib hash object
+    values : numpy.ndarray
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'Mm':
+        values = values.astype('datetime64[ns]' if values.dtype.kind == 'M' else 'timedelta64[ns]')
+        values = values.view(np.int64)
+    elif values.dtype.kind == 'O':
+        values = np.array([str(v) for v in values])
+    hasher.update(str(values.dtype).encode())
+    hasher.update(np.ascontiguousarray(values).tobytes())
+
+
+def hash_catalog(dataframe, columns=None):
+    """
+    returns a content hash of the catalog index and columns
+
+    only the given columns are hashed, so catalogs that differ in
+    columns a computation does not read share cache entries. missing
+    columns are skipped.
+
+    dataframe : pandas.DataFrame or catalog.Catalog
+    columns : list
+    return : str
+    """
+    if columns is None:
+        columns = list(dataframe.columns)
+    hasher = hashlib.blake2b(digest_size=16)
+    _update_hash(hasher, np.asarray(dataframe.index))
+    for column in columns:
+        if column in dataframe:
+            hasher.update(str(column).encode())
+            values = np.asarray(dataframe[column])
+            if values.dtype.kind == 'f':
+                # equal values hash equally whatever the float dtype; float32
+                # errors of a catalog.Catalog are rounded, so they differ from
+                # the float64 dataframe values and get their own entries
+                values = values.astype(np.float64)
+            _update_hash(hasher, values)
+    return hasher.hexdigest()
+
+
+def make_key(*parts):
+    """
+    returns a cache key for the given parts
+
+    parts are hashed by their repr, so they should be catalog hashes,
+    numbers, strings or small sequences of those, converted to plain
+    python types first: 10 and numpy.int64(10) have different reprs.
+
+    parts : any
+    return : str
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(repr(part).encode())
+        hasher.update(b'\x00')
+    return hasher.hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, key + EXTENSION)
+
+
+def load(key, cache_dir):
+    """
+    returns the arrays stored under key or None on a cache miss
+
+    a hit refreshes the entry's modification time, which is what
+    eviction uses as its least recently used order. unreadable entries
+    (e.g. truncated by a crashed writer) count as misses.
+
+    key : str
+    cache_dir : str
+    return : dict
+    """
+    path = _entry_path(key, cache_dir)
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        os.utime(path, None)
+    except (IOError, OSError, ValueError, zipfile.BadZipFile):
+        return None
+    return arrays
+
+
+def store(key, arrays, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    stores arrays under key and evicts old entries over the size budget
+
+    arrays : dict of numpy.ndarray
+    key : str
+    cache_dir : str
+    max_bytes : int
+    return : None
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, _entry_path(key, cache_dir))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    directory = os.path.abspath(cache_dir)
+    if directory in _directory_sizes:
+        _directory_sizes[directory] += os.path.getsize(_entry_path(key, cache_dir))
+    else:
+        _directory_sizes[directory] = _entries_size(_list_entries(cache_dir))
+    if _directory_sizes[directory] > max_bytes:
+        evict(cache_dir, int(max_bytes * EVICTION_TARGET))
+
+
+def _list_entries(cache_dir):
+    """
+    returns (mtime, size, path) of every entry of a cache directory
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(EXTENSION):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def _entries_size(entries):
+    return sum(size for _, size, _ in entries)
+
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    removes least recently used entries until the cache fits max_bytes
+
+    cache_dir : str
+    max_bytes : int
+    return : None
+    """
+    entries = _list_entries(cache_dir)
+    total = _entries_size(entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    _directory_sizes[os.path.abspath(cache_dir)] = max(total, 0)
+
+
+def clear(cache_dir):
+    """
+    removes all entries from a cache directory
+
+    cache_dir : str
+    return : None
+    """
+    evict(cache_dir, max_bytes=-1)
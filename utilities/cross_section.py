@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+"""
+great circle cross sections through earthquake catalogs.
+
+a profile is a polyline of (lon, lat) vertices, the simplest being its
+two endpoints. events within half_width km of the profile are projected
+onto it, giving the distance along the profile and the perpendicular
+offset of every event.
+
+candidates come from a cKDTree of the events' cartesian positions
+(distance.spherical_to_cartesian), queried at points spaced along each
+segment. the projection is then done for all candidates and segments at
+once with cross and dot products of unit vectors.
+
+"""
+
+import numpy as np
+from scipy import spatial
+from utilities import distance
+
+
+def event_tree(data):
+    """
+    returns a cKDTree of the events' surface positions in km
+
+    pass it to get_cross_section to reuse it across calls.
+
+    data : pandas.DataFrame or catalog.Catalog
+    return : scipy.spatial.cKDTree
+    """
+    vectors = distance.spherical_to_cartesian(np.asarray(data.lon, dtype=np.float64)
+                                              , np.asarray(data.lat, dtype=np.float64), None)
+    return spatial.cKDTree(np.atleast_2d(vectors))
+
+
+def _unit_vectors(lons, lats):
+    return np.atleast_2d(distance.spherical_to_cartesian(lons, lats, None)) / distance.EARTH_RADIUS
+
+
+def _candidates(tree, vertices, half_width):
+    """
+    returns the indices of the events possibly within half_width km of
+    the profile, by querying the tree at points at most half_width
+    apart along every segment
+    """
+    queries = []
+    for a, b in zip(vertices[:-1], vertices[1:]):
+        angle = np.arccos(np.clip(np.dot(a, b), -1., 1.))
+        n_points = int(np.ceil(angle * distance.EARTH_RADIUS / half_width)) + 1
+        t = np.linspace(0., 1., n_points)[:, np.newaxis]
+        if angle > 0:
+            points = (np.sin((1. - t) * angle) * a + np.sin(t * angle) * b) / np.sin(angle)
+        else:
+            points = a[np.newaxis, :]
+        queries.append(points)
+    queries = np.concatenate(queries) * distance.EARTH_RADIUS
+
+    # every point of the swath is within half the sample spacing along
+    # the segment and half_width across it of a query point
+    radius = np.sqrt(half_width ** 2 + (half_width / 2.) ** 2)
+    hits = tree.query_ball_point(queries, r=radius)
+    if len(hits) == 0:
+        return np.array([], dtype=np.int64)
+    return np.unique(np.concatenate([np.asarray(hit, dtype=np.int64) for hit in hits]))
+
+
+def _project(vectors, vertices, half_width):
+    """
+    projects unit vectors onto a polyline of unit vertices
+
+    returns a mask of the vectors inside the swath, and their distance
+    along the profile and signed offset in km. where swaths of two
+    segments overlap the segment with the smaller offset is used.
+    """
+    a = vertices[:-1]
+    b = vertices[1:]
+    normals = np.cross(a, b)
+    norms = np.linalg.norm(normals, axis=1)
+    valid = norms > 0
+    normals[valid] /= norms[valid][:, np.newaxis]
+    lengths = np.arccos(np.clip(np.sum(a * b, axis=1), -1., 1.))
+    offsets_from = np.concatenate([[0.], np.cumsum(lengths)[:-1]])
+
+    # (events, segments) matrices of perpendicular and along angles
+    sin_offset = np.clip(vectors.dot(normals.T), -1., 1.)
+    offset = np.arcsin(sin_offset)
+    along = np.arctan2(np.einsum('ij,kj->ik', vectors, np.cross(normals, a))
+                       , vectors.dot(a.T))
+
+    width = half_width / distance.EARTH_RADIUS
+    in_swath = (np.abs(offset) <= width) & (along >= 0) & (along <= lengths) & valid
+    abs_offset = np.where(in_swath, np.abs(offset), np.inf)
+    segment = np.argmin(abs_offset, axis=1)
+    rows = np.arange(vectors.shape[0])
+    inside = in_swath[rows, segment]
+    along_profile = (offsets_from[segment] + along[rows, segment]) * distance.EARTH_RADIUS
+    offset = offset[rows, segment] * distance.EARTH_RADIUS
+    return inside, along_profile, offset
+
+
+def get_cross_section(data, profile, half_width, tree=None):
+    """
+    returns the events within half_width km of a profile projected
+    onto it
+
+    offsets are positive to the left of the profile direction. events
+    are ordered by their position in data.
+
+    data : pandas.DataFrame or catalog.Catalog
+    profile : list of (lon, lat) vertices
+    half_width : float
+    tree : scipy.spatial.cKDTree returned by event_tree
+    return : tuple of event indices, distance along the profile (km),
+        offset from the profile (km) and depth (km), all numpy.ndarray
+    """
+    if tree is None:
+        tree = event_tree(data)
+    profile = np.asarray(profile, dtype=np.float64)
+    vertices = _unit_vectors(profile[:, 0], profile[:, 1])
+
+    indices = _candidates(tree, vertices, half_width)
+    vectors = tree.data[indices] / distance.EARTH_RADIUS
+    inside, along, offset = _project(vectors, vertices, half_width)
+
+    indices = indices[inside]
+    depths = np.asarray(data.depth, dtype=np.float64)[indices]
+    return indices, along[inside], offset[inside], depths
+
+
+def get_cross_sections(data, profiles, half_width):
+    """
+    returns get_cross_section for every profile, building the spatial
+    index of data once
+
+    data : pandas.DataFrame or catalog.Catalog
+    profiles : list of profiles
+    half_width : float
+    return : list of tuples
+    """
+    tree = event_tree(data)
+    return [get_cross_section(data, profile, half_width, tree=tree) for profile in profiles]
+
+
+def parallel_profiles(start, end, spacing, n_profiles):
+    """
+    returns n_profiles two point profiles parallel to start -> end,
+    centred on it and spacing km apart
+
+    start : list of lon, lat
+    end : list of lon, lat
+    spacing : float
+    n_profiles : int
+    return : list of profiles
+    """
+    a = _unit_vectors(start[0], start[1])[0]
+    b = _unit_vectors(end[0], end[1])[0]
+    normal = np.cross(a, b)
+    normal /= np.linalg.norm(normal)
+
+    profiles = []
+    for shift in (np.arange(n_profiles) - (n_profiles - 1) / 2.) * spacing:
+        angle = shift / distance.EARTH_RADIUS
+        ends = [np.cos(angle) * v + np.sin(angle) * normal for v in (a, b)]
+        profiles.append([(np.degrees(np.arctan2(v[1], v[0])), np.degrees(np.arcsin(np.clip(v[2], -1., 1.))))
+                         for v in ends])
+    return profiles
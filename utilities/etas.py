@@ -0,0 +1,407 @@
+# -*- encoding: utf-8 -*-
+"""
+maximum likelihood fitting of ETAS models.
+
+the temporal model has the conditional intensity (times in days)
+
+    lambda(t) = mu + sum_{t_i < t} K exp(alpha (m_i - mc)) (t - t_i + c) ** -p
+
+i.e. a constant background plus modified Omori (Omori-Utsu) aftershock
+rates scaled by the magnitude of every triggering event. the space-time
+model multiplies every triggering term with the isotropic kernel
+
+    f(r) = (q - 1) / (pi D) (1 + r ** 2 / D) ** -q
+
+and spreads the background uniformly over the catalog area.
+
+the triggering sums are truncated: pairs more than max_dt days apart
+(and, in space-time, more than max_distance km apart) are dropped, the
+time integral is cut at max_dt as well and the expected number of
+triggered events is scaled by the mass of f within max_distance,
+1 - (1 + max_distance ** 2 / D) ** (1 - q), so the likelihood is exact
+for the truncated kernel. the pairs only depend on the catalog and the
+cutoffs, so they are found once per cutoffs with a time-sorted sweep,
+and every likelihood and gradient evaluation is a handful of vectorized
+sums over them.
+
+fit_etas by default cuts every kernel where its remaining tail is
+negligible for the fitted parameters (see tail_cutoffs) instead of at
+max_dt, fitting in stages of growing cutoffs. short kernels and small
+events then contribute far fewer pairs.
+
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import optimize
+from utilities import kernels
+from utilities import stats
+
+#: names of the temporal model parameters.
+TEMPORAL_PARAMETERS = ['mu', 'K', 'alpha', 'c', 'p']
+
+#: names of the space-time model parameters.
+SPACE_TIME_PARAMETERS = TEMPORAL_PARAMETERS + ['D', 'q']
+
+#: optimizer bounds of the transformed parameters, see _to_internal.
+_BOUNDS = {'mu': (-30., 10.), 'K': (-30., 5.), 'alpha': (0., 5.), 'c': (-12., 2.)
+           , 'p': (0.2, 4.), 'D': (-10., 10.), 'q': (1.01, 5.)}
+
+#: parameters optimized as logarithms.
+_LOG_PARAMETERS = ('mu', 'K', 'c', 'D')
+
+#: cutoff of the first fit_etas stage as a fraction of max_dt.
+_FIRST_STAGE_CUTOFF = 0.01
+
+#: most refits fit_etas runs to lengthen the cutoffs.
+_MAX_STAGES = 10
+
+#: prepared catalog of a fit_etas process pool worker.
+_worker_catalog = None
+
+
+def _trigger_pairs(times, max_dt):
+    """
+    returns (first, second) index arrays of all event pairs with
+    0 <= times[second] - times[first] <= max_dt[first] and first < second
+
+    indices are int32 when they fit, which halves the memory of the
+    pairs of large catalogs.
+
+    times : numpy.ndarray, sorted ascending
+    max_dt : float or numpy.ndarray of the cutoff of every event
+    return : tuple of numpy.ndarray
+    """
+    n = times.shape[0]
+    dtype = np.int32 if n < 2 ** 31 else np.int64
+    upper = np.searchsorted(times, times + max_dt, side='right')
+    counts = upper - np.arange(n) - 1
+    first = np.repeat(np.arange(n, dtype=dtype), counts)
+    offsets = np.arange(first.shape[0], dtype=dtype) - np.repeat((np.cumsum(counts) - counts).astype(dtype), counts)
+    second = first + 1 + offsets
+    return first, second
+
+
+def _catalog_events(df, mc=None, spatial=False, area=None):
+    """
+    returns the time-sorted events at or above mc that the pairs and
+    the likelihood are built from
+
+    df : pandas.DataFrame or catalog.Catalog with a timestamp index
+    mc : float
+    spatial : bool
+    area : float
+    return : dict
+    """
+    mags = np.asarray(df.mag, dtype=np.float64)
+    if mc is None:
+        mc = stats.calc_fmd_stats_with_mc(mags)[4]
+    times = np.asarray(df.index).astype('datetime64[ns]').view(np.int64)
+    keep = mags >= mc
+    order = np.argsort(times[keep], kind='mergesort')
+    times = times[keep][order]
+    events = {'mc': mc, 'dm': mags[keep][order] - mc, 'days': (times - times[0]) / 86400e9, 'area': 1.}
+
+    if spatial:
+        lons = np.asarray(df.lon, dtype=np.float64)[keep][order]
+        lats = np.asarray(df.lat, dtype=np.float64)[keep][order]
+        if area is None:
+            area = ((lons.max() - lons.min()) * (lats.max() - lats.min())
+                    * 111.19 ** 2 * np.cos(np.deg2rad(lats.mean())))
+        events.update({'lons': lons, 'lats': lats, 'area': area})
+    return events
+
+
+def _prepare_pairs(events, cutoffs, max_distance=None):
+    """
+    returns the prepared catalog of events whose triggering kernels are
+    cut cutoffs days after every event
+
+    events : dict returned by _catalog_events
+    cutoffs : float or numpy.ndarray, days
+    max_distance : float, km
+    return : dict
+    """
+    days = events['days']
+    first, second = _trigger_pairs(days, cutoffs)
+    prepared = {'mc': events['mc'], 'dm': events['dm'], 'first': first, 'second': second
+                , 'dt': days[second] - days[first], 'duration': days[-1] - days[0]
+                , 'tau': np.minimum(days[-1] - days, cutoffs), 'area': events['area']}
+
+    if 'lons' in events:
+        lons = events['lons']
+        lats = events['lats']
+        r = kernels.geodetic_distance(lons[first], lats[first], lons[second], lats[second])
+        if max_distance is not None:
+            near = r <= max_distance
+            for name in ('first', 'second', 'dt'):
+                prepared[name] = prepared[name][near]
+            r = r[near]
+        prepared['r2'] = r ** 2
+        prepared['max_distance'] = max_distance
+    return prepared
+
+
+def prepare_catalog(df, mc=None, max_dt=10., spatial=False, max_distance=None, area=None):
+    """
+    returns the arrays the likelihood needs for a catalog, with every
+    triggering kernel cut max_dt days after its event
+
+    events below mc are dropped. mc defaults to the magnitude of
+    completeness of stats.calc_fmd_stats_with_mc.
+
+    df : pandas.DataFrame or catalog.Catalog with a timestamp index
+    mc : float
+    max_dt : float, days
+    spatial : bool, whether to prepare for the space-time model
+    max_distance : float, km, space-time pairs further apart are dropped
+    area : float, km ** 2 of the background, defaults to the bounding
+        box of the events
+    return : dict
+    """
+    events = _catalog_events(df, mc=mc, spatial=spatial, area=area)
+    return _prepare_pairs(events, float(max_dt), max_distance=max_distance)
+
+
+def tail_cutoffs(params, dm, max_dt, tolerance):
+    """
+    returns the time cutoff of every event such that the expected number
+    of events its kernel triggers between the cutoff and max_dt is at
+    most tolerance times the mean number an event triggers within max_dt
+
+    the cutoffs grow with magnitude: a small event triggers few events,
+    so most of its kernel can be dropped. summed over the catalog at
+    most a tolerance fraction of the triggered events is lost.
+
+    params : dict of parameter values
+    dm : numpy.ndarray, magnitudes above mc
+    max_dt : float, days
+    tolerance : float
+    return : numpy.ndarray, days
+    """
+    alpha, c, p = params['alpha'], params['c'], params['p']
+    weights = np.exp(alpha * (dm - dm.max()))
+    full = _omori_integral(max_dt, c, p)[0]
+    # the integral of the kernel up to the cutoff has to reach this
+    needed = full * (1. - tolerance * weights.mean() / weights)
+    q = 1. - p
+    with np.errstate(invalid='ignore', over='ignore'):
+        if abs(q) < 1e-8:
+            cutoffs = c * np.exp(needed) - c
+        else:
+            cutoffs = (c ** q + q * needed) ** (1. / q) - c
+    cutoffs = np.where(needed > 0., cutoffs, 0.)
+    return np.clip(np.where(np.isnan(cutoffs), max_dt, cutoffs), 0., max_dt)
+
+
+def _omori_integral(tau, c, p):
+    """
+    returns the integral of (s + c) ** -p from 0 to tau and its
+    derivatives by c and p
+    """
+    q = 1. - p
+    log_c = np.log(c)
+    log_tc = np.log(tau + c)
+    d_c = (tau + c) ** -p - c ** -p
+    if abs(q) < 1e-8:
+        integral = log_tc - log_c
+        d_p = -(log_tc ** 2 - log_c ** 2) / 2.
+    else:
+        a = c ** q
+        b = (tau + c) ** q
+        integral = (b - a) / q
+        d_p = -((b * log_tc - a * log_c) * q - (b - a)) / q ** 2
+    return integral, d_c, d_p
+
+
+def log_likelihood(params, prepared):
+    """
+    returns the ETAS log-likelihood and its gradient
+
+    the model is space-time when prepared has pair distances (see
+    prepare_catalog) and params has D and q.
+
+    params : dict of parameter values
+    prepared : dict returned by prepare_catalog
+    return : tuple of the log-likelihood and a dict of its derivatives
+    """
+    mu, K, alpha, c, p = [params[name] for name in TEMPORAL_PARAMETERS]
+    spatial = 'D' in params
+    first = prepared['first']
+    second = prepared['second']
+    dt = prepared['dt']
+    dm = prepared['dm']
+    area = prepared['area']
+
+    productivity = K * np.exp(alpha * dm)
+    log_base = np.log(dt + c)
+    h = productivity[first] * np.exp(-p * log_base)
+    if spatial:
+        D, q = params['D'], params['q']
+        log_spread = np.log1p(prepared['r2'] / D)
+        h *= (q - 1.) / (np.pi * D) * np.exp(-q * log_spread)
+
+    # spatial mass of the kernel inside the truncation distance
+    mass = 1.
+    max_distance = prepared.get('max_distance') if spatial else None
+    if max_distance is not None:
+        R2 = max_distance ** 2
+        log_spread_R = np.log1p(R2 / D)
+        tail = np.exp((1. - q) * log_spread_R)
+        mass = 1. - tail
+
+    rates = mu / area + np.bincount(second, weights=h, minlength=dm.shape[0])
+    integral, d_integral_c, d_integral_p = _omori_integral(prepared['tau'], c, p)
+    unscaled = productivity * integral
+    expected = unscaled * mass
+    value = np.sum(np.log(rates)) - mu * prepared['duration'] - np.sum(expected)
+
+    weighted = h / rates[second]
+    gradient = {'mu': np.sum(1. / rates) / area - prepared['duration']
+                , 'K': (np.sum(weighted) - np.sum(expected)) / K
+                , 'alpha': np.sum(weighted * dm[first]) - np.sum(expected * dm)
+                , 'c': -p * np.sum(weighted / (dt + c)) - mass * np.sum(productivity * d_integral_c)
+                , 'p': -np.sum(weighted * log_base) - mass * np.sum(productivity * d_integral_p)}
+    if spatial:
+        r2 = prepared['r2']
+        gradient['D'] = np.sum(weighted * (-1. / D + q * r2 / (D * (D + r2))))
+        gradient['q'] = np.sum(weighted * (1. / (q - 1.) - log_spread))
+        if max_distance is not None:
+            total = np.sum(unscaled)
+            gradient['D'] += total * (q - 1.) * tail * R2 / (D * (D + R2))
+            gradient['q'] -= total * tail * log_spread_R
+    return value, gradient
+
+
+def _to_internal(params, names):
+    return np.array([np.log(params[n]) if n in _LOG_PARAMETERS else params[n] for n in names])
+
+
+def _from_internal(x, names):
+    return {n: np.exp(v) if n in _LOG_PARAMETERS else v for n, v in zip(names, x)}
+
+
+def _negative_log_likelihood(x, names, prepared):
+    params = _from_internal(x, names)
+    value, gradient = log_likelihood(params, prepared)
+    jacobian = np.array([gradient[n] * params[n] if n in _LOG_PARAMETERS else gradient[n] for n in names])
+    if not np.isfinite(value):
+        return np.inf, np.zeros_like(x)
+    return -value, -jacobian
+
+
+def _set_worker_catalog(prepared):
+    """
+    process pool initializer, sends the prepared catalog to every worker
+    once instead of with every start
+    """
+    global _worker_catalog
+    _worker_catalog = prepared
+
+
+def _fit_from_start(x0, names, prepared=None):
+    """
+    runs one L-BFGS-B optimization, module level so process pools can
+    pickle it. pool workers use the catalog of _set_worker_catalog.
+    """
+    if prepared is None:
+        prepared = _worker_catalog
+    result = optimize.minimize(_negative_log_likelihood, x0, args=(names, prepared), jac=True
+                               , method='L-BFGS-B', bounds=[_BOUNDS[n] for n in names])
+    return result.x, -result.fun, result.success
+
+
+def _random_starts(prepared, names, n_starts, seed):
+    random_state = np.random.RandomState(seed)
+    background = prepared['dm'].shape[0] / max(prepared['duration'], 1e-9)
+    starts = []
+    for _ in range(n_starts):
+        params = {'mu': background * random_state.uniform(0.1, 0.9)
+                  , 'K': random_state.uniform(0.005, 0.1), 'alpha': random_state.uniform(0.5, 2.5)
+                  , 'c': random_state.uniform(0.001, 0.1), 'p': random_state.uniform(1.0, 1.5)
+                  , 'D': random_state.uniform(1., 10.), 'q': random_state.uniform(1.3, 2.5)}
+        starts.append(_to_internal(params, names))
+    return starts
+
+
+def fit_etas(df, mc=None, max_dt=10., spatial=False, max_distance=None, area=None
+             , tolerance=0.01, n_starts=8, n_jobs=None, seed=None):
+    """
+    fits an ETAS model to a catalog by maximum likelihood
+
+    the cost of a likelihood evaluation grows with the number of event
+    pairs within the time cutoffs, which with a fixed max_dt is the
+    number of events times the events in max_dt days. with a tolerance
+    the fit runs in stages instead: n_starts optimizations from random
+    starting points on kernels cut at max_dt / 100, then refits from the
+    best one with the cutoffs of tail_cutoffs for the fitted parameters,
+    lengthened until they cover the fitted kernels. every stage is exact
+    for its cutoffs, and the final fit loses at most a tolerance fraction
+    of the triggered events to the cutoffs. tolerance=None cuts every
+    kernel at max_dt and runs all starts on the full pairs.
+
+    the cost is set by the pairs of the last stages, about 0.5 s per 1e7
+    pairs and likelihood evaluation on one core, with tens of
+    evaluations per stage. a short fitted kernel needs short cutoffs,
+    while a heavy tailed one (p close to 1) needs cutoffs close to max_dt
+    for most events. on one core, 1e5 events of
+    event_pairs.synthetic_clustered_catalog (2.9e7 pairs within 10 days)
+    fit in about 40 s with 8.7e6 pairs in the last stage instead of 20
+    minutes for 8 starts at max_dt, and a simulated ETAS catalog of
+    1.3e5 events with p = 1.2 (3.5e7 pairs) in about 75 s, its last
+    stage using almost all pairs. the parameters agree with the fits at
+    max_dt within 1 %, except K of the clustered catalog within 4 %.
+
+    the random starts run on n_jobs processes, every process receiving
+    the prepared catalog once.
+
+    df : pandas.DataFrame or catalog.Catalog with a timestamp index
+    mc : float, see prepare_catalog
+    max_dt : float, days
+    spatial : bool, fit the space-time model
+    max_distance : float, km
+    area : float, km ** 2
+    tolerance : float, see tail_cutoffs
+    n_starts : int
+    n_jobs : int, defaults to the number of cpus
+    seed : int
+    return : dict of the fitted parameters, log_likelihood, mc, n and
+        n_pairs of the last stage
+    """
+    events = _catalog_events(df, mc=mc, spatial=spatial, area=area)
+    names = SPACE_TIME_PARAMETERS if spatial else TEMPORAL_PARAMETERS
+    if tolerance is None:
+        cutoffs = np.full(events['dm'].shape[0], float(max_dt))
+    else:
+        cutoffs = np.full(events['dm'].shape[0], max_dt * _FIRST_STAGE_CUTOFF)
+    prepared = _prepare_pairs(events, cutoffs, max_distance=max_distance)
+    starts = _random_starts(prepared, names, n_starts, seed)
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        results = [_fit_from_start(x0, names, prepared) for x0 in starts]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_set_worker_catalog
+                                 , initargs=(prepared,)) as executor:
+            results = list(executor.map(_fit_from_start, starts, [names] * len(starts)))
+    x, value, success = max(results, key=lambda result: result[1])
+
+    for _ in range(_MAX_STAGES):
+        if tolerance is None:
+            break
+        needed = tail_cutoffs(_from_internal(x, names), events['dm'], max_dt, tolerance)
+        if np.all(needed <= cutoffs):
+            break
+        # a little headroom for the refitted kernels; growing at most
+        # fourfold per stage keeps the stages cheap while the early fits
+        # overestimate the tails
+        cutoffs = np.minimum(np.minimum(1.25 * needed, 4. * cutoffs), max_dt)
+        prepared = _prepare_pairs(events, cutoffs, max_distance=max_distance)
+        x, value, success = _fit_from_start(x, names, prepared)
+
+    fitted = _from_internal(x, names)
+    fitted.update({'log_likelihood': value, 'success': success, 'mc': events['mc']
+                   , 'n': events['dm'].shape[0], 'n_pairs': prepared['first'].shape[0]})
+    return fitted
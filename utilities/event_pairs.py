@@ -0,0 +1,211 @@
+# -*- encoding: utf-8 -*-
+"""
+space-time event pair queries for swarm and repeater detection.
+
+finds all pairs of events closer than max_distance km (hypocentral
+distance, see distance.distance) and max_dt seconds. the catalog is
+swept in time order in blocks; each block is matched against a cKDTree
+of the events of the preceding max_dt window, so the work grows with
+the number of events times the window density instead of N ** 2.
+
+pairs are returned as compact arrays of event indices (earlier event
+first), distances in km and time differences in seconds. a callback
+can consume the pairs block by block to keep memory bounded.
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import spatial
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from utilities import distance
+from utilities import kernels
+
+
+def _event_arrays(data):
+    """
+    returns times (int64 ns), lons, lats and depths of a catalog, depths
+    being zero when the catalog has no depth column
+    """
+    times = np.asarray(data.index).astype('datetime64[ns]').view(np.int64)
+    lons = np.asarray(data.lon, dtype=np.float64)
+    lats = np.asarray(data.lat, dtype=np.float64)
+    if 'depth' in data:
+        depths = np.asarray(data.depth, dtype=np.float64)
+    else:
+        depths = np.zeros_like(lons)
+    return times, lons, lats, depths
+
+
+def _empty_pairs():
+    return (np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+            , np.array([], dtype=np.float64), np.array([], dtype=np.float64))
+
+
+def iter_event_pairs(data, max_distance, max_dt, block_size=10000):
+    """
+    yields the event pairs within max_distance km and max_dt seconds,
+    one block of events at a time
+
+    every pair is yielded once, as (first, second, distances, dts) with
+    first the index (position in data) of the earlier event.
+
+    data : pandas.DataFrame or catalog.Catalog
+    max_distance : float
+    max_dt : float
+    block_size : int
+    return : generator of tuples of numpy.ndarray
+    """
+    times, lons, lats, depths = _event_arrays(data)
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    lons = lons[order]
+    lats = lats[order]
+    depths = depths[order]
+    vectors = np.atleast_2d(distance.spherical_to_cartesian(lons, lats, depths))
+
+    max_dt_ns = int(max_dt * 1e9)
+    # chords are slightly shorter than distance.distance, the margin keeps
+    # the tree query a superset that the exact distance then trims
+    radius = max_distance * 1.01 + 1e-6
+
+    for start in range(0, times.shape[0], block_size):
+        stop = min(start + block_size, times.shape[0])
+        window_start = np.searchsorted(times, times[start] - max_dt_ns, side='left')
+
+        block_tree = spatial.cKDTree(vectors[start:stop])
+        window_tree = spatial.cKDTree(vectors[window_start:stop])
+        candidates = block_tree.sparse_distance_matrix(window_tree, radius, output_type='ndarray')
+
+        second = candidates['i'].astype(np.int64) + start
+        first = candidates['j'].astype(np.int64) + window_start
+        dts = times[second] - times[first]
+        keep = (first < second) & (dts <= max_dt_ns)
+        first = first[keep]
+        second = second[keep]
+
+        distances = kernels.hypocentral_distance(lons[first], lats[first], depths[first]
+                                                 , lons[second], lats[second], depths[second])
+        keep = distances <= max_distance
+        first = first[keep]
+        second = second[keep]
+        yield (order[first], order[second], distances[keep]
+               , (times[second] - times[first]) / 1e9)
+
+
+def get_event_pairs(data, max_distance, max_dt, callback=None, block_size=10000):
+    """
+    returns the event pairs within max_distance km and max_dt seconds
+
+    when callback is given it is called with (first, second, distances,
+    dts) for every block instead of collecting the pairs, and None is
+    returned.
+
+    data : pandas.DataFrame or catalog.Catalog
+    max_distance : float
+    max_dt : float
+    callback : function
+    block_size : int
+    return : tuple of first and second event indices (earlier event
+        first), distances (km) and time differences (s)
+    """
+    blocks = []
+    for pairs in iter_event_pairs(data, max_distance, max_dt, block_size=block_size):
+        if callback is None:
+            blocks.append(pairs)
+        else:
+            callback(*pairs)
+
+    if callback is not None:
+        return None
+    if len(blocks) == 0:
+        return _empty_pairs()
+    return tuple(np.concatenate(arrays) for arrays in zip(*blocks))
+
+
+def cluster_pairs(n_events, first, second):
+    """
+    returns the connected component of every event, events being linked
+    by the given pairs
+
+    n_events : int
+    first : numpy.ndarray
+    second : numpy.ndarray
+    return : tuple of the number of clusters and the cluster labels
+    """
+    links = coo_matrix((np.ones(first.shape[0], dtype=np.int8), (first, second))
+                       , shape=(n_events, n_events))
+    return connected_components(links, directed=False)
+
+
+def get_event_clusters(data, max_distance, max_dt, block_size=10000):
+    """
+    returns the space-time clusters of a catalog: events are in one
+    cluster when a chain of pairs within max_distance km and max_dt
+    seconds connects them
+
+    data : pandas.DataFrame or catalog.Catalog
+    max_distance : float
+    max_dt : float
+    block_size : int
+    return : numpy.ndarray of cluster labels
+    """
+    first, second, _, _ = get_event_pairs(data, max_distance, max_dt, block_size=block_size)
+    n_clusters, labels = cluster_pairs(np.asarray(data.lon).shape[0], first, second)
+    return labels
+
+
+def synthetic_clustered_catalog(n_events, n_clusters, cluster_size=5., cluster_duration=86400.
+                                , years=10., seed=None):
+    """
+    returns a catalog dataframe of n_events, half of them background
+    events spread over southern california and half in n_clusters
+    swarms of cluster_size km and cluster_duration seconds
+
+    n_events : int
+    n_clusters : int
+    cluster_size : float
+    cluster_duration : float
+    years : float
+    seed : int
+    return : pandas.DataFrame
+    """
+    random_state = np.random.RandomState(seed)
+    duration = years * 365.25 * 86400.
+    n_background = n_events // 2
+    n_clustered = n_events - n_background
+
+    centres = random_state.randint(n_clusters, size=n_clustered)
+    centre_lon = random_state.uniform(-120., -115., n_clusters)
+    centre_lat = random_state.uniform(32., 36., n_clusters)
+    centre_time = random_state.uniform(0., duration, n_clusters)
+    spread = cluster_size / 111.19
+
+    lon = np.concatenate([random_state.uniform(-120., -115., n_background)
+                          , random_state.normal(centre_lon[centres], spread)])
+    lat = np.concatenate([random_state.uniform(32., 36., n_background)
+                          , random_state.normal(centre_lat[centres], spread)])
+    seconds = np.concatenate([random_state.uniform(0., duration, n_background)
+                              , centre_time[centres] + random_state.exponential(cluster_duration, n_clustered)])
+    depth = random_state.uniform(0., 20., n_events)
+    mag = random_state.exponential(1. / np.log(10.), n_events) + 1.
+
+    index = pd.DatetimeIndex(np.datetime64('2000-01-01', 'ns') + (seconds * 1e9).astype('timedelta64[ns]')
+                             , name='timestamp')
+    df = pd.DataFrame({'lon': lon, 'lat': lat, 'depth': depth, 'mag': mag}, index=index)
+    return df.sort_index()
+
+
+if __name__ == '__main__':
+    # throughput on synthetic clustered catalogs:
+    # python -m utilities.event_pairs
+    import time
+
+    for n_events in (10 ** 4, 10 ** 5, 10 ** 6):
+        df = synthetic_clustered_catalog(n_events, n_clusters=n_events // 100, seed=0)
+        started = time.time()
+        first, second, distances, dts = get_event_pairs(df, max_distance=5., max_dt=86400.)
+        elapsed = time.time() - started
+        print('{n} events: {p} pairs in {t:.2f} s ({r:.0f} events/s)'
+              .format(n=n_events, p=first.shape[0], t=elapsed, r=n_events / elapsed))
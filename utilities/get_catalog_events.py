@@ -1,8 +1,9 @@
-# shapely polygon selection
+# catalog event selection, see polygon_selection for polygons
 
-from shapely.geometry import Point
 import numpy as np
 from scipy import spatial
+from utilities import catalog
+from utilities import kernels
 
 def cartesian_distance_between_two_three_vectors(vector_a, vector_b):
     """
@@ -41,29 +42,20 @@ def get_node_data(node, radius, data, m):
     """
     returns data within a circle with given radius
 
+    dataframes are returned with a distance column, catalog.Catalog
+    inputs as a Catalog of the selected events.
+
     node : list
     radius : float
-    data : pandas.DataFrame
+    data : pandas.DataFrame or catalog.Catalog
     m : mpl_toolkits.Basemap
-    return : pandas.DataFrame
+    return : pandas.DataFrame or catalog.Catalog
     """
     node_lon = node[0]
     node_lat = node[1]
 
-    distance_from_node = (radius * 1.2) / 111.19
-
-    lon_bounds = [node_lon - distance_from_node, node_lon + distance_from_node]
-    lat_bounds = [node_lat - distance_from_node, node_lat + distance_from_node]
-
-    df = data.copy()
-    df = df[df.lon.between(lon_bounds[0], lon_bounds[1]) &
-            df.lat.between(lat_bounds[0], lat_bounds[1])]
-    if df.shape[0] > 0:
-        df['distance'] = df.apply(lambda row: distance_between_two_coordinates(row['lat'], row['lon'], node_lat, node_lon),
-                              axis=1)
-        df = df[df.distance <= radius]
-        return df
-    else:
-        df['distance'] = radius + 1
-        df = df[df.distance <= radius]
-        return df
+    indices, distance = kernels.radius_selection(data.lon, data.lat, node_lon, node_lat, radius)
+    selected = catalog.take(data, indices)
+    if isinstance(selected, catalog.Catalog):
+        return selected
+    return selected.assign(distance=distance)
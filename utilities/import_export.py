@@ -1,29 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 from utilities import timestamps
 
-def import_catalog(location, timestamp_column='decimal_year', **kwargs):
+#: columns of a normalized catalog, see normalize_catalog.
+SCHEMA_COLUMNS = ['lon', 'lat', 'depth', 'mag', 'event_id', 'source']
+
+#: import_catalog arguments and column names of known catalog formats.
+CATALOG_FORMATS = {
+    'anss': {'timestamp_column': ['Date', 'Time']
+             , 'timestamp_format': '%Y/%m/%d %H:%M:%S.%f'
+             , 'fixed_width': True
+             , 'columns': {'Lon': 'lon', 'Lat': 'lat', 'Depth': 'depth', 'Mag': 'mag', 'Event ID': 'event_id'}
+             , 'kwargs': {'skiprows': [1], 'dtype': {'Event ID': str}}},
+    'scedc': {'timestamp_column': ['#YYY/MM/DD', 'HH:mm:SS.ss']
+              , 'timestamp_format': '%Y/%m/%d %H:%M:%S.%f'
+              , 'columns': {'LON': 'lon', 'LAT': 'lat', 'DEPTH': 'depth', 'MAG': 'mag', 'EVID': 'event_id'}
+              , 'kwargs': {'sep': r'\s+', 'dtype': {'EVID': str}}},
+}
+
+def import_catalog(location, timestamp_column='decimal_year', timestamp_format=None, fixed_width=False
+                   , **kwargs):
     """
     imports column names and returns dataframe with timestamp index
-    
+
     accepts kwargs for pandas.read_csv
 
+    timestamp_column is either a conversion name ('decimal_year',
+    'epoch_time' or 'none') or a list of columns whose values joined
+    with spaces are parsed by pandas.to_datetime with timestamp_format,
+    e.g. ['Date', 'Time'].
+
     location : ?
-    timestamp_column : str
+    timestamp_column : str or list
+    timestamp_format : str
+    fixed_width : bool, read with pandas.read_fwf instead
     kwargs : pandas.read_csv kwargs
     """
     # TODO : provide ability to parse header files
     timestamp_conversion = {'decimal_year':timestamps.convert_decimal_year_to_numpy_datetime64
                            ,'epoch_time':timestamps.convert_epoch_to_numpy_datetime64
                            ,'none':None}
-    
-    df = pd.read_csv(location, **kwargs)
-    if timestamp_conversion[timestamp_column] is None:
+
+    if fixed_width:
+        df = pd.read_fwf(location, **kwargs)
+    else:
+        df = pd.read_csv(location, **kwargs)
+    if isinstance(timestamp_column, (list, tuple)):
+        text = df[timestamp_column[0]].astype(str)
+        if len(timestamp_column) > 1:
+            text = text.str.cat([df[c].astype(str) for c in timestamp_column[1:]], sep=' ')
+        df['timestamp'] = pd.to_datetime(text, format=timestamp_format)
+    elif timestamp_conversion[timestamp_column] is None:
         pass
     else:
         df['timestamp'] = df[timestamp_column].apply(timestamp_conversion[timestamp_column])
     df = df.set_index('timestamp')
     return df
 
+def normalize_catalog(dataframe, columns=None, source=None):
+    """
+    returns a catalog with the columns of SCHEMA_COLUMNS
+
+    columns renames catalog specific column names to schema names.
+    missing schema columns are filled with NaN.
+
+    dataframe : pandas.DataFrame
+    columns : dict
+    source : str
+    return : pandas.DataFrame
+    """
+    df = dataframe.rename(columns=columns or {})
+    normalized = pd.DataFrame(index=df.index)
+    for column in SCHEMA_COLUMNS:
+        if column == 'source':
+            normalized[column] = source
+        elif column in df:
+            normalized[column] = df[column].values
+        else:
+            normalized[column] = np.nan
+    normalized.index.name = 'timestamp'
+    return normalized
+
+def _import_source(spec):
+    """
+    imports and normalizes one source of import_catalogs
+    """
+    spec = dict(CATALOG_FORMATS.get(spec.get('format'), {}), **spec)
+    df = import_catalog(spec['location']
+                        , timestamp_column=spec.get('timestamp_column', 'decimal_year')
+                        , timestamp_format=spec.get('timestamp_format')
+                        , fixed_width=spec.get('fixed_width', False)
+                        , **spec.get('kwargs', {}))
+    return normalize_catalog(df, columns=spec.get('columns'), source=spec.get('source', spec.get('format')))
+
+def import_catalogs(sources, max_workers=None, processes=False):
+    """
+    imports several catalogs concurrently and returns them as one
+    normalized dataframe sorted by time
+
+    every source is a dict with the location of the file and either a
+    format from CATALOG_FORMATS or the import_catalog arguments
+    (timestamp_column, timestamp_format, fixed_width, kwargs) and a
+    columns renaming dict. source names the catalog in the source
+    column and defaults to the format, e.g.
+
+    [{'location': 'data/anss.csv', 'format': 'anss'},
+     {'location': 'data/scedc.csv', 'format': 'scedc', 'source': 'scedc'}]
+
+    sources : list of dict
+    max_workers : int
+    processes : bool, parse on a process pool instead of threads
+    return : pandas.DataFrame
+    """
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as executor:
+        catalogs = list(executor.map(_import_source, sources))
+    return pd.concat(catalogs).sort_index(kind='mergesort')
+
 def export_catalog(dataframe, **kwargs):
     """
     exports data as csv
@@ -31,4 +126,4 @@ def export_catalog(dataframe, **kwargs):
     dataframe : pandas.DataFrame
     kwargs : pandas.DataFrame.to_csv kwargs
     """
-    dataframe.to_csv(**kwargs)
\ No newline at end of file
+    dataframe.to_csv(**kwargs)
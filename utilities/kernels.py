@@ -0,0 +1,496 @@
+# -*- encoding: utf-8 -*-
+"""
+compiled kernels for the distance, geodesic and fmd hot loops.
+
+every kernel has a pure numpy implementation and, when numba is
+installed, a numba one compiled with parallel loops. the numba backend
+is used by default when available; set_backend switches at runtime and
+the numpy backend is always there to fall back to.
+
+kernels:
+
+    geodetic_distance : distance.geodetic_distance
+    hypocentral_distance : distance.distance
+    azimuth           : distance.azimuth
+    direct_geodesic   : basemap_util.shoot over arrays
+    radius_selection  : the circle selection of get_node_data
+    fmd_moments       : the sums behind stats.fmd_values
+
+radius_selection runs on numpy with either backend: its vectorized
+bounding box test was faster than the numba loops tried.
+
+run python -m utilities.kernels for parity checks against the original
+functions and timings of both backends.
+
+"""
+
+import numpy as np
+from utilities import distance
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#: names of the available backends.
+BACKENDS = ['numpy'] + (['numba'] if numba is not None else [])
+
+_backend = 'numba' if numba is not None else 'numpy'
+
+
+def get_backend():
+    """
+    returns the name of the backend in use
+
+    return : str
+    """
+    return _backend
+
+
+def set_backend(name):
+    """
+    selects the backend used by the kernels of this module
+
+    name : str, 'numpy' or 'numba'
+    return : None
+    """
+    global _backend
+    if name not in ('numpy', 'numba'):
+        raise ValueError('unknown kernel backend {n}'.format(n=name))
+    if name not in BACKENDS:
+        raise ImportError('the numba kernel backend needs numba installed')
+    _backend = name
+
+
+# numpy backend
+
+def _geodetic_distance_numpy(lons1, lats1, lons2, lats2, diameter):
+    lons1, lats1, lons2, lats2 = distance._prepare_coords(lons1, lats1, lons2, lats2)
+    # same formula as distance.geodetic_distance, reusing buffers
+    dlat = np.sin((lats1 - lats2) / 2.0)
+    dlat *= dlat
+    dlon = np.sin((lons1 - lons2) / 2.0)
+    dlon *= dlon
+    dlon *= np.cos(lats1)
+    dlon *= np.cos(lats2)
+    dlat += dlon
+    if np.ndim(dlat) == 0:
+        return diameter * np.arcsin(np.sqrt(dlat))
+    np.sqrt(dlat, out=dlat)
+    np.arcsin(dlat, out=dlat)
+    dlat *= diameter
+    return dlat
+
+
+def _direct_geodesic_numpy(lons, lats, azimuths, distances):
+    """
+    basemap_util.shoot for arrays; the convergence loop iterates until
+    every element has converged
+    """
+    glat1 = np.radians(lats)
+    glon1 = np.radians(lons)
+    s = distances / 1.852
+    faz = np.radians(azimuths)
+
+    eps = 0.00000000005
+    a = 6378.13 / 1.852
+    f = 1 / 298.257223563
+    r = 1 - f
+    tu = r * np.tan(glat1)
+    sf = np.sin(faz)
+    cf = np.cos(faz)
+    b = np.where(cf == 0, 0., 2. * np.arctan2(tu, cf))
+
+    cu = 1. / np.sqrt(1 + tu * tu)
+    su = tu * cu
+    sa = cu * sf
+    c2a = 1 - sa * sa
+    x = 1. + np.sqrt(1. + c2a * (1. / (r * r) - 1.))
+    x = (x - 2.) / x
+    c = 1. - x
+    c = (x * x / 4. + 1.) / c
+    d = (0.375 * x * x - 1.) * x
+    tu = s / (r * a * c)
+    y = tu.copy()
+    c = y + 1
+    sy = np.zeros_like(y)
+    cy = np.zeros_like(y)
+    cz = np.zeros_like(y)
+    e = np.zeros_like(y)
+    active = np.flatnonzero(np.abs(y - c) > eps)
+    while active.shape[0] > 0:
+        ya = y[active]
+        sy[active] = np.sin(ya)
+        cy[active] = np.cos(ya)
+        cz[active] = np.cos(b[active] + ya)
+        e[active] = 2. * cz[active] * cz[active] - 1.
+        c[active] = ya
+        xa = e[active] * cy[active]
+        yn = e[active] + e[active] - 1.
+        da = d[active]
+        y[active] = (((sy[active] * sy[active] * 4. - 3.) * yn * cz[active] * da / 6. + xa)
+                     * da / 4. - cz[active]) * sy[active] * da + tu[active]
+        active = active[np.abs(y[active] - c[active]) > eps]
+
+    b = cu * cy * cf - su * sy
+    c = r * np.sqrt(sa * sa + b * b)
+    d = su * cy + cu * sy * cf
+    glat2 = (np.arctan2(d, c) + np.pi) % (2 * np.pi) - np.pi
+    c = cu * cy - su * sy * cf
+    x = np.arctan2(sy * sf, c)
+    c = ((-3. * c2a + 4.) * f + 4.) * c2a * f / 16.
+    d = ((e * cy * c + cz) * sy * c + y) * sa
+    glon2 = ((glon1 + x - (1. - c) * d * f + np.pi) % (2 * np.pi)) - np.pi
+    baz = (np.arctan2(sa, b) + np.pi) % (2 * np.pi)
+    return np.degrees(glon2), np.degrees(glat2), np.degrees(baz)
+
+
+def _radius_selection_numpy(lons, lats, node_lon, node_lat, radius):
+    distance_from_node = (radius * 1.2) / 111.19
+    candidates = np.flatnonzero((lons >= node_lon - distance_from_node)
+                                & (lons <= node_lon + distance_from_node)
+                                & (lats >= node_lat - distance_from_node)
+                                & (lats <= node_lat + distance_from_node))
+    lat_km = 111.19 * (lats[candidates] - node_lat)
+    lon_km = 111.19 * (lons[candidates] - node_lon) * np.cos(np.deg2rad(lats[candidates]))
+    distances = np.sqrt(lon_km ** 2 + lat_km ** 2)
+    inside = distances <= radius
+    return candidates[inside], distances[inside]
+
+
+def _fmd_moments_numpy(magnitudes):
+    length = magnitudes.shape[0]
+    average = magnitudes.mean()
+    deviations = magnitudes - average
+    return length, magnitudes.min(), average, np.dot(deviations, deviations)
+
+
+# numba backend
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _geodetic_distance_loop(lons1, lats1, lons2, lats2, diameter, out):
+        for i in numba.prange(out.shape[0]):
+            lon1 = np.radians(lons1[i])
+            lat1 = np.radians(lats1[i])
+            lon2 = np.radians(lons2[i])
+            lat2 = np.radians(lats2[i])
+            dlat = np.sin((lat1 - lat2) / 2.0)
+            dlon = np.sin((lon1 - lon2) / 2.0)
+            out[i] = diameter * np.arcsin(np.sqrt(dlat * dlat + np.cos(lat1) * np.cos(lat2) * dlon * dlon))
+
+    @numba.njit(parallel=True, cache=True)
+    def _azimuth_loop(lons1, lats1, lons2, lats2, out):
+        for i in numba.prange(out.shape[0]):
+            lon1 = np.radians(lons1[i])
+            lat1 = np.radians(lats1[i])
+            lon2 = np.radians(lons2[i])
+            lat2 = np.radians(lats2[i])
+            cos_lat2 = np.cos(lat2)
+            true_course = np.degrees(np.arctan2(
+                np.sin(lon1 - lon2) * cos_lat2,
+                np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * cos_lat2 * np.cos(lon1 - lon2)))
+            out[i] = (360 - true_course) % 360
+
+    @numba.njit(parallel=True, cache=True)
+    def _direct_geodesic_loop(lons, lats, azimuths, distances, out_lon, out_lat, out_baz):
+        eps = 0.00000000005
+        a = 6378.13 / 1.852
+        f = 1 / 298.257223563
+        r = 1 - f
+        for i in numba.prange(lons.shape[0]):
+            glat1 = lats[i] * np.pi / 180.
+            glon1 = lons[i] * np.pi / 180.
+            s = distances[i] / 1.852
+            faz = azimuths[i] * np.pi / 180.
+            tu = r * np.tan(glat1)
+            sf = np.sin(faz)
+            cf = np.cos(faz)
+            if cf == 0:
+                b = 0.
+            else:
+                b = 2. * np.arctan2(tu, cf)
+            cu = 1. / np.sqrt(1 + tu * tu)
+            su = tu * cu
+            sa = cu * sf
+            c2a = 1 - sa * sa
+            x = 1. + np.sqrt(1. + c2a * (1. / (r * r) - 1.))
+            x = (x - 2.) / x
+            c = 1. - x
+            c = (x * x / 4. + 1.) / c
+            d = (0.375 * x * x - 1.) * x
+            tu = s / (r * a * c)
+            y = tu
+            c = y + 1
+            sy = 0.
+            cy = 0.
+            cz = 0.
+            e = 0.
+            while np.abs(y - c) > eps:
+                sy = np.sin(y)
+                cy = np.cos(y)
+                cz = np.cos(b + y)
+                e = 2. * cz * cz - 1.
+                c = y
+                x = e * cy
+                y = e + e - 1.
+                y = (((sy * sy * 4. - 3.) * y * cz * d / 6. + x) * d / 4. - cz) * sy * d + tu
+            b = cu * cy * cf - su * sy
+            c = r * np.sqrt(sa * sa + b * b)
+            d = su * cy + cu * sy * cf
+            glat2 = (np.arctan2(d, c) + np.pi) % (2 * np.pi) - np.pi
+            c = cu * cy - su * sy * cf
+            x = np.arctan2(sy * sf, c)
+            c = ((-3. * c2a + 4.) * f + 4.) * c2a * f / 16.
+            d = ((e * cy * c + cz) * sy * c + y) * sa
+            glon2 = ((glon1 + x - (1. - c) * d * f + np.pi) % (2 * np.pi)) - np.pi
+            baz = (np.arctan2(sa, b) + np.pi) % (2 * np.pi)
+            out_lon[i] = glon2 * 180. / np.pi
+            out_lat[i] = glat2 * 180. / np.pi
+            out_baz[i] = baz * 180. / np.pi
+
+    @numba.njit(parallel=True, cache=True)
+    def _fmd_moments_loop(magnitudes):
+        n = magnitudes.shape[0]
+        total = 0.
+        minimum = np.inf
+        for i in numba.prange(n):
+            total += magnitudes[i]
+            minimum = min(minimum, magnitudes[i])
+        average = total / n
+        squares = 0.
+        for i in numba.prange(n):
+            squares += (magnitudes[i] - average) ** 2
+        return minimum, average, squares
+
+
+def _flat_float_arrays(*arrays):
+    arrays = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in arrays])
+    shape = arrays[0].shape
+    return shape, [np.ascontiguousarray(a).ravel() for a in arrays]
+
+
+def _scalar_or_array(values, shape):
+    values = values.reshape(shape)
+    return values[()] if shape == () else values
+
+
+# dispatching kernels
+
+def geodetic_distance(lons1, lats1, lons2, lats2, diameter=2 * distance.EARTH_RADIUS):
+    """
+    distance.geodetic_distance on the selected backend
+
+    lons1, lats1, lons2, lats2 : floats or numpy.ndarray that broadcast
+    diameter : float
+    return : distance in km, float or numpy.ndarray
+    """
+    if _backend == 'numpy':
+        return _geodetic_distance_numpy(lons1, lats1, lons2, lats2, diameter)
+    shape, (lons1, lats1, lons2, lats2) = _flat_float_arrays(lons1, lats1, lons2, lats2)
+    out = np.empty(lons1.shape[0])
+    _geodetic_distance_loop(lons1, lats1, lons2, lats2, diameter, out)
+    return _scalar_or_array(out, shape)
+
+
+def hypocentral_distance(lons1, lats1, depths1, lons2, lats2, depths2):
+    """
+    distance.distance on the selected backend: the hypocentral distance
+    combining geodetic_distance and the depth difference
+
+    lons1, lats1, depths1, lons2, lats2, depths2 : floats or
+        numpy.ndarray that broadcast
+    return : distance in km, float or numpy.ndarray
+    """
+    hdist = geodetic_distance(lons1, lats1, lons2, lats2)
+    vdist = np.subtract(depths1, depths2, dtype=np.float64)
+    return np.hypot(hdist, vdist)
+
+
+def azimuth(lons1, lats1, lons2, lats2):
+    """
+    distance.azimuth on the selected backend
+
+    lons1, lats1, lons2, lats2 : floats or numpy.ndarray that broadcast
+    return : azimuth in decimal degrees, float or numpy.ndarray
+    """
+    if _backend == 'numpy':
+        return distance.azimuth(lons1, lats1, lons2, lats2)
+    shape, (lons1, lats1, lons2, lats2) = _flat_float_arrays(lons1, lats1, lons2, lats2)
+    out = np.empty(lons1.shape[0])
+    _azimuth_loop(lons1, lats1, lons2, lats2, out)
+    return _scalar_or_array(out, shape)
+
+
+def direct_geodesic(lons, lats, azimuths, distances):
+    """
+    basemap_util.shoot on the selected backend: the points reached
+    from lons, lats going distances km along azimuths
+
+    lons, lats, azimuths, distances : floats or numpy.ndarray that broadcast
+    return : tuple of lons, lats and back azimuths in decimal degrees
+    """
+    shape, (lons, lats, azimuths, distances) = _flat_float_arrays(lons, lats, azimuths, distances)
+    if _backend == 'numpy':
+        results = _direct_geodesic_numpy(lons, lats, azimuths, distances)
+    else:
+        results = tuple(np.empty(lons.shape[0]) for _ in range(3))
+        _direct_geodesic_loop(lons, lats, azimuths, distances, *results)
+    return tuple(_scalar_or_array(values, shape) for values in results)
+
+
+def radius_selection(lons, lats, node_lon, node_lat, radius):
+    """
+    returns the indices and distances of the points within radius km
+    of a node, with the flat earth distance of
+    get_catalog_events.distance_between_two_coordinates
+
+    lons : numpy.ndarray
+    lats : numpy.ndarray
+    node_lon : float
+    node_lat : float
+    radius : float
+    return : tuple of numpy.ndarray
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    return _radius_selection_numpy(lons, lats, node_lon, node_lat, radius)
+
+
+def fmd_moments(magnitudes):
+    """
+    returns the number, minimum, mean and sum of squared deviations
+    from the mean of magnitudes
+
+    magnitudes : numpy.ndarray
+    return : tuple
+    """
+    magnitudes = np.asarray(magnitudes, dtype=np.float64)
+    if _backend == 'numpy' or magnitudes.shape[0] == 0:
+        return _fmd_moments_numpy(magnitudes)
+    minimum, average, squares = _fmd_moments_loop(magnitudes)
+    # numpy floats, so fmd_values divides by zero to nan like the numpy backend
+    return magnitudes.shape[0], np.float64(minimum), np.float64(average), np.float64(squares)
+
+
+def _check_parity(n_events=100000, seed=0):
+    """
+    compares every kernel of the selected backend with the original
+    function and raises AssertionError on a mismatch
+    """
+    import warnings
+    from utilities import basemap_util
+    from utilities import get_catalog_events
+
+    random_state = np.random.RandomState(seed)
+    lons1 = random_state.uniform(-180., 180., n_events)
+    lats1 = random_state.uniform(-89., 89., n_events)
+    lons2 = random_state.uniform(-180., 180., n_events)
+    lats2 = random_state.uniform(-89., 89., n_events)
+
+    np.testing.assert_allclose(geodetic_distance(lons1, lats1, lons2, lats2)
+                               , distance.geodetic_distance(lons1, lats1, lons2, lats2), rtol=1e-12, atol=1e-9)
+    depths1 = random_state.uniform(0., 700., n_events)
+    depths2 = random_state.uniform(0., 700., n_events)
+    np.testing.assert_allclose(hypocentral_distance(lons1, lats1, depths1, lons2, lats2, depths2)
+                               , distance.distance(lons1, lats1, depths1, lons2, lats2, depths2), rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(azimuth(lons1, lats1, lons2, lats2)
+                               , distance.azimuth(lons1, lats1, lons2, lats2), rtol=1e-12, atol=1e-9)
+
+    azimuths = random_state.uniform(0., 360., 200)
+    distances = random_state.uniform(0., 5000., 200)
+    expected = np.array([basemap_util.shoot(lon, lat, az, dist) for lon, lat, az, dist
+                         in zip(lons1[:200], lats1[:200], azimuths, distances)])
+    np.testing.assert_allclose(np.array(direct_geodesic(lons1[:200], lats1[:200], azimuths, distances)).T
+                               , expected, rtol=1e-12, atol=1e-9)
+
+    node_lon, node_lat, radius = 10., 45., 500.
+    lons = random_state.uniform(0., 20., n_events)
+    lats = random_state.uniform(40., 50., n_events)
+    indices, node_distances = radius_selection(lons, lats, node_lon, node_lat, radius)
+    expected = get_catalog_events.distance_between_two_coordinates(lats, lons, node_lat, node_lon)
+    # get_node_data's degree bounding box prefilter comes first
+    in_box = (np.abs(lons - node_lon) <= radius * 1.2 / 111.19) & (np.abs(lats - node_lat) <= radius * 1.2 / 111.19)
+    np.testing.assert_array_equal(indices, np.flatnonzero(in_box & (expected <= radius)))
+    np.testing.assert_allclose(node_distances, expected[indices], rtol=1e-12)
+
+    magnitudes = random_state.exponential(0.43, n_events) + 1.
+    length, minimum, average, squares = fmd_moments(magnitudes)
+    assert length == n_events and minimum == magnitudes.min()
+    np.testing.assert_allclose(average, magnitudes.mean(), rtol=1e-12)
+    np.testing.assert_allclose(squares, np.sum((magnitudes - magnitudes.mean()) ** 2), rtol=1e-10)
+
+    # edge cases: scalar coordinates, a single magnitude and no events
+    np.testing.assert_allclose(geodetic_distance(0., 0., 1., 1.)
+                               , distance.geodetic_distance(0., 0., 1., 1.), rtol=1e-12)
+    np.testing.assert_allclose(hypocentral_distance(0., 0., 10., 1., 1., 30.)
+                               , distance.distance(0., 0., 10., 1., 1., 30.), rtol=1e-12)
+    np.testing.assert_allclose(azimuth(0., 0., 1., 1.), distance.azimuth(0., 0., 1., 1.), rtol=1e-12)
+    np.testing.assert_allclose(direct_geodesic(10., 45., 30., 100.)
+                               , basemap_util.shoot(10., 45., 30., 100.), rtol=1e-12, atol=1e-9)
+    assert np.ndim(geodetic_distance(0., 0., 1., 1.)) == 0
+    assert np.ndim(hypocentral_distance(0., 0., 10., 1., 1., 30.)) == 0
+
+    from utilities import stats
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a_value, b_value, b_error, length = stats.fmd_values(np.array([2.5]))
+    assert length == 1 and np.isnan(b_error)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            fmd_moments(np.array([]))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('fmd_moments of no magnitudes must raise ValueError like numpy')
+    indices, node_distances = radius_selection(np.array([]), np.array([]), node_lon, node_lat, radius)
+    assert indices.shape[0] == 0 and node_distances.shape[0] == 0
+
+
+def _benchmark(n_events, seed=0):
+    """
+    returns the seconds every kernel of the selected backend takes on
+    n_events random inputs, after one warm up call
+    """
+    import time
+
+    random_state = np.random.RandomState(seed)
+    lons1 = random_state.uniform(-180., 180., n_events)
+    lats1 = random_state.uniform(-89., 89., n_events)
+    lons2 = random_state.uniform(-180., 180., n_events)
+    lats2 = random_state.uniform(-89., 89., n_events)
+    azimuths = random_state.uniform(0., 360., n_events)
+    distances = random_state.uniform(0., 5000., n_events)
+
+    calls = [('geodetic_distance', lambda: geodetic_distance(lons1, lats1, lons2, lats2))
+             , ('azimuth', lambda: azimuth(lons1, lats1, lons2, lats2))
+             , ('direct_geodesic', lambda: direct_geodesic(lons1, lats1, azimuths, distances))
+             , ('radius_selection', lambda: radius_selection(lons1, lats1, 10., 45., 500.))
+             , ('fmd_moments', lambda: fmd_moments(distances))]
+    timings = []
+    for name, call in calls:
+        call()
+        started = time.time()
+        call()
+        timings.append((name, time.time() - started))
+    return timings
+
+
+if __name__ == '__main__':
+    # parity checks and timings of every backend:
+    # python -m utilities.kernels [n_events]
+    import sys
+
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7
+    results = {}
+    for backend in BACKENDS:
+        set_backend(backend)
+        _check_parity()
+        results[backend] = _benchmark(n_events)
+        print('{b}: parity ok'.format(b=backend))
+    if numba is not None:
+        print('numba threads: {t}'.format(t=numba.config.NUMBA_NUM_THREADS))
+    for i, (name, _) in enumerate(results['numpy']):
+        print('{k:<18}'.format(k=name) + ''.join(
+            '  {b} {t:7.3f} s'.format(b=backend, t=results[backend][i][1]) for backend in BACKENDS))
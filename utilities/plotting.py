@@ -1,6 +1,7 @@
 # plotting utilities
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 from utilities import stats
 from mpl_toolkits.basemap import Basemap, cm
@@ -17,20 +18,18 @@ def plot_seismicity_rate(dataframe, fig, ax, **kwargs):
     
     assumes dataframe has timestamp column
 
-    dataframe : pandas.DataFrame
+    dataframe : pandas.DataFrame or catalog.Catalog
     fig : mpl Figure
     ax : mpl Axes
     kwargs : axes kwargs
     """
-    df = dataframe.copy()
-#     df = df.set_index('timestamp')
-    df['seismicity_rate'] = np.arange(0, df.shape[0], 1)
+    n_events = dataframe.shape[0]
+    seismicity_rate = pd.Series(np.arange(0, n_events, 1), index=dataframe.index)
     
-    # fig, ax = plt.subplots(figsize=(10, 4))
-    df.seismicity_rate.plot(ax=ax, **kwargs)
+    seismicity_rate.plot(ax=ax, **kwargs)
     ax.set_xlabel('')
     ax.set_ylabel('cumulative eq count')
-    if df.shape[0] > 10000:
+    if n_events > 10000:
         ax.ticklabel_format(style='sci', axis='y', scilimits=(0, 0))
         
     return fig, ax
@@ -87,14 +86,14 @@ def plot_fmd_diagram(df, fig, ax, bins=100, range=[0, 10], **kwargs):
     """
     Plots fmd diagram with fit line for given magnitudes.
     
-    df : pandas.DataFrame
+    df : pandas.DataFrame or catalog.Catalog
     fig : mpl Figure
     ax : mpl Axes
     bins : int
     range : list
     kwargs : axes kwargs
     """
-    mags = df.mag
+    mags = np.asarray(df.mag)
     hist, edges = np.histogram(a=mags, bins=bins, range=range)
     chist = np.cumsum(hist[::-1])[::-1]
 
@@ -111,3 +110,25 @@ def plot_fmd_diagram(df, fig, ax, bins=100, range=[0, 10], **kwargs):
     ax.set_ylim(1e0, 10 ** a)
     ax.set_xlim(0, mags.max() + 1)
     ax.set_title('b={b}$\pm${bstd}, n={n}, mc={mc}'.format(b=round(b, 2), bstd=round(bstd, 2), n=n, mc=mc))
+
+
+def plot_cross_section(cross_section, df, fig, ax, **kwargs):
+    """
+    plots a cross section as depth against distance along the profile,
+    magnitude proportional to size.
+
+    cross_section : tuple returned by cross_section.get_cross_section
+    df : pandas.DataFrame or catalog.Catalog the section was taken from
+    fig : mpl Figure
+    ax : mpl Axes
+    kwargs : axes kwargs
+    """
+    indices, along, offset, depths = cross_section
+    mags = np.asarray(df.mag)[indices]
+    ax.scatter(along, depths, s=1*np.exp(mags/2.), edgecolor='None', **kwargs)
+    ax.set_xlabel('distance along profile (km)')
+    ax.set_ylabel('depth (km)')
+    if not ax.yaxis_inverted():
+        ax.invert_yaxis()
+
+    return fig, ax
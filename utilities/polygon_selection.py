@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+"""
+selection of catalog events inside lon/lat polygons.
+
+polygons are tested with a vectorized even-odd ray casting kernel over
+the coordinate arrays. events are sorted by longitude cell and latitude
+once, each ring only looks at the events inside its bounding box, and
+each ring edge only at the events in its latitude band, so many
+polygons can be tested against large catalogs in one pass.
+
+a polygon is given as one ring (a sequence of (lon, lat) vertices), a
+list of rings, or a shapely Polygon/MultiPolygon. rings are combined
+with the even-odd rule, so multi-part polygons and holes work without
+knowing which ring is which.
+
+edges join their vertices along constant-rate longitude, so a ring is
+ambiguous at the antimeridian: an edge 170 -> -170 is 340 degrees wide
+as given, or 20 degrees wide across the antimeridian. rings are taken
+as given by default; a ring crossing the antimeridian can use
+longitudes beyond 180 (170 -> 190). with antimeridian=True every edge
+wider than 180 degrees is taken to cross the antimeridian instead, which
+is wrong for rings that really have such wide edges, e.g. a box from
+-100 to 100.
+
+"""
+
+import numpy as np
+from utilities import catalog
+
+#: width in degrees of the longitude cells events are bucketed into.
+CELL_WIDTH = 10.
+
+
+def _polygon_rings(polygon):
+    """
+    returns the rings of a polygon as (n, 2) arrays of lon, lat
+
+    polygon : list, numpy.ndarray or shapely geometry
+    return : list
+    """
+    if hasattr(polygon, 'geoms'):
+        return [ring for part in polygon.geoms for ring in _polygon_rings(part)]
+    if hasattr(polygon, 'exterior'):
+        return [np.asarray(polygon.exterior.coords, dtype=np.float64)[:, :2]] \
+            + [np.asarray(ring.coords, dtype=np.float64)[:, :2] for ring in polygon.interiors]
+    if np.ndim(polygon[0]) == 1:
+        return [np.asarray(polygon, dtype=np.float64)]
+    return [np.asarray(ring, dtype=np.float64) for ring in polygon]
+
+
+def _index_events(lons, lats):
+    """
+    sorts events by longitude cell, then latitude
+
+    the sort key of an event is cell * 200 + lat + 100, so the events
+    of one cell inside a latitude range are a contiguous run of the
+    sorted keys.
+
+    lons : numpy.ndarray
+    lats : numpy.ndarray
+    return : tuple of sorted lons, lats, keys and the sorting indices
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    cells = np.floor((lons % 360.) / CELL_WIDTH)
+    keys = cells * 200. + (lats + 100.)
+    order = np.argsort(keys)
+    return lons[order], lats[order], keys[order], order
+
+
+def _ring_indices(index, ring, antimeridian=False):
+    """
+    returns the indices of the events inside a single ring
+
+    index : tuple returned by _index_events
+    ring : numpy.ndarray
+    antimeridian : bool, unwrap edges wider than 180 degrees
+    return : numpy.ndarray
+    """
+    sorted_lons, sorted_lats, keys, order = index
+    ring_lons = ring[:, 0]
+    if antimeridian:
+        ring_lons = np.degrees(np.unwrap(np.radians(ring_lons)))
+    ring_lats = ring[:, 1]
+    lon_min, lon_max = ring_lons.min(), ring_lons.max()
+    lat_min, lat_max = ring_lats.min(), ring_lats.max()
+
+    # bounding box prefilter: bisect the latitude range inside every
+    # longitude cell the ring spans, then map longitudes into the
+    # ring's unwrapped window [lon_min, lon_min + 360)
+    n_cells = int(round(360. / CELL_WIDTH))
+    first_cell = np.floor((lon_min % 360.) / CELL_WIDTH)
+    span = min(int(np.floor((lon_max - lon_min) / CELL_WIDTH)) + 2, n_cells)
+    cells = (first_cell + np.arange(span)) % n_cells
+    starts = np.searchsorted(keys, cells * 200. + (lat_min + 100.), side='left')
+    stops = np.searchsorted(keys, cells * 200. + (lat_max + 100.), side='right')
+    positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, stops)])
+    xs = (sorted_lons[positions] - lon_min) % 360. + lon_min
+    in_box = xs <= lon_max
+    positions = positions[in_box]
+    xs = xs[in_box]
+    ys = sorted_lats[positions]
+    by_lat = np.argsort(ys, kind='mergesort')
+    positions = positions[by_lat]
+    xs = xs[by_lat]
+    ys = ys[by_lat]
+
+    x1 = ring_lons
+    y1 = ring_lats
+    x2 = np.roll(x1, -1)
+    y2 = np.roll(y1, -1)
+    starts = np.searchsorted(ys, np.minimum(y1, y2), side='left')
+    stops = np.searchsorted(ys, np.maximum(y1, y2), side='left')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (x2 - x1) / (y2 - y1)
+
+    inside = np.zeros(positions.shape[0], dtype=bool)
+    for i in np.flatnonzero(stops > starts):
+        s, e = starts[i], stops[i]
+        inside[s:e] ^= xs[s:e] < x1[i] + (ys[s:e] - y1[i]) * slopes[i]
+    return order[positions[inside]]
+
+
+def _polygon_indices(index, polygon, antimeridian=False):
+    """
+    returns the sorted indices of the events inside a polygon
+    """
+    rings = _polygon_rings(polygon)
+    indices = [_ring_indices(index, ring, antimeridian) for ring in rings]
+    if len(indices) == 1:
+        return np.sort(indices[0])
+    indices, counts = np.unique(np.concatenate(indices), return_counts=True)
+    return indices[counts % 2 == 1]
+
+
+def points_in_polygon(lons, lats, polygon, antimeridian=False):
+    """
+    returns a boolean mask of the points inside polygon
+
+    lons : numpy.ndarray
+    lats : numpy.ndarray
+    polygon : list, numpy.ndarray or shapely geometry
+    antimeridian : bool, see the module docstring
+    return : numpy.ndarray
+    """
+    index = _index_events(lons, lats)
+    mask = np.zeros(index[0].shape[0], dtype=bool)
+    mask[_polygon_indices(index, polygon, antimeridian)] = True
+    return mask
+
+
+def polygon_labels(lons, lats, polygons, fill=-1, antimeridian=False):
+    """
+    returns the position in polygons of the polygon containing each
+    point
+
+    points outside every polygon are labelled fill. points inside
+    overlapping polygons get the label of the first one.
+
+    lons : numpy.ndarray
+    lats : numpy.ndarray
+    polygons : list
+    fill : int
+    antimeridian : bool, see the module docstring
+    return : numpy.ndarray
+    """
+    index = _index_events(lons, lats)
+    labels = np.full(index[0].shape[0], fill, dtype=np.int64)
+    # fill may be a valid label, so assignment is tracked separately
+    assigned = np.zeros(index[0].shape[0], dtype=bool)
+    for label, polygon in enumerate(polygons):
+        indices = _polygon_indices(index, polygon, antimeridian)
+        indices = indices[~assigned[indices]]
+        labels[indices] = label
+        assigned[indices] = True
+    return labels
+
+
+def get_polygon_data(polygon, data, antimeridian=False):
+    """
+    returns the events inside polygon
+
+    polygon : list, numpy.ndarray or shapely geometry
+    data : pandas.DataFrame or catalog.Catalog
+    antimeridian : bool, see the module docstring
+    return : pandas.DataFrame or catalog.Catalog
+    """
+    index = _index_events(data.lon, data.lat)
+    return catalog.take(data, _polygon_indices(index, polygon, antimeridian))
+
+
+def get_polygons_labels(polygons, data, fill=-1, antimeridian=False):
+    """
+    returns the label of the polygon containing each event, see
+    polygon_labels
+
+    polygons : list
+    data : pandas.DataFrame or catalog.Catalog
+    fill : int
+    antimeridian : bool, see the module docstring
+    return : numpy.ndarray
+    """
+    return polygon_labels(data.lon, data.lat, polygons, fill=fill, antimeridian=antimeridian)
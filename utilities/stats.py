@@ -6,7 +6,10 @@ functions useful for statistical seismology.
 
 import numpy as np
 import pandas as pd
-from utilities import polygon_selection
+from utilities import cache
+from utilities import catalog
+from utilities import kernels
+from utilities import get_catalog_events
 
 def mc_maximum_curvature(magnitudes):
     """
@@ -37,12 +40,10 @@ def fmd_values(magnitudes, bin_width=0.1):
     """
 
 
-    length = magnitudes.shape[0]
-    minimum = magnitudes.min()
-    average = magnitudes.mean()
+    length, minimum, average, squares = kernels.fmd_moments(magnitudes)
     b_value = (1 / (average - (minimum - (bin_width / 2)))) * np.log10(np.exp(1))
 
-    sigma_mag = np.sum([((m - average) ** 2) / (length * (length - 1)) for m in magnitudes])
+    sigma_mag = squares / (length * (length - 1))
     b_error = 2.3 * b_value ** 2 * np.sqrt(sigma_mag)
 
     a_value = np.log10(length) + b_value * minimum
@@ -83,76 +84,146 @@ def generate_b_based_on_location_mag_normal_error(df, location, radius):
     mag        : magnitude
     hz_err_deg : error in the horizontal plane
     
+    a catalog.Catalog has no hz_err_deg, its horizontal_error in km
+    is converted to degrees instead.
+
     assumes a 0.1 standard deviation of magnitude error
     assumes all data comes from a normal distribution    
     """
-    err_df = df.copy()
-    err_df['lon'] = np.random.normal(df['lon'].values, df['hz_err_deg'].values+0.001)
-    err_df['lat'] = np.random.normal(df['lat'].values, df['hz_err_deg'].values+0.001)
-    err_df['mag'] = np.random.normal(df['mag'], 0.1)
-    node_df = get_node_data(node=location, radius=radius, data=err_df)
+    if 'hz_err_deg' in df:
+        hz_err_deg = np.asarray(df['hz_err_deg'], dtype=np.float64)
+    else:
+        hz_err_deg = np.asarray(df['horizontal_error'], dtype=np.float64) / 111.113
+    err_df = catalog.assign(df, lon=np.random.normal(np.asarray(df['lon']), hz_err_deg + 0.001)
+                            , lat=np.random.normal(np.asarray(df['lat']), hz_err_deg + 0.001)
+                            , mag=np.random.normal(np.asarray(df['mag']), 0.1))
+    node_df = get_catalog_events.get_node_data(node=location, radius=radius, data=err_df, m=None)
     a, b, bstd, n, mc = calc_fmd_stats_with_mc(node_df.mag)
     return a, b, bstd, n, mc
 
-def calc_bootstrapped_fmd_values(df, n_calculations):
+def _random_state(seed):
+    """
+    returns a seeded numpy.random.RandomState or the global
+    numpy.random state when seed is None
+    """
+    if seed is None:
+        return np.random
+    return np.random.RandomState(seed)
+
+def calc_bootstrapped_fmd_values(df, n_calculations, seed=None, cache_dir=None
+                                 , max_bytes=cache.DEFAULT_MAX_BYTES):
     """
     calculates bootstrapped fmd values
 
+    results are memoized in cache_dir when both seed and cache_dir
+    are given.
+
     :param df: input dataframe
-    :type df: pandas.dataframe
+    :type df: pandas.dataframe or catalog.Catalog
     :param n_calculations: number of times to bootstrap input dataframe
     :type n_calculations: int
+    :param seed: seed of the bootstrap resampling
+    :type seed: int
+    :param cache_dir: directory of the result cache
+    :type cache_dir: str
+    :param max_bytes: size budget of the result cache
+    :type max_bytes: int
     :return: fmd statistics (a,b,bstd,n,mc) calculated
     :rtype: list
     """
+    key = None
+    if cache_dir is not None and seed is not None:
+        key = cache.make_key('calc_bootstrapped_fmd_values'
+                             , cache.hash_catalog(df, ['mag']), int(n_calculations), int(seed))
+        cached = cache.load(key, cache_dir)
+        if cached is not None:
+            return [tuple(row) for row in cached['fmd_values']]
+
+    random_state = _random_state(seed)
+    magnitudes = np.asarray(df.mag)
     fmd_values = []
     for n in range(n_calculations):
-        fmd_values.append(calc_fmd_stats_with_mc(df.ix[np.random.choice(df.index, size=(1, df.shape[0]))[0]].mag))
+        sample = random_state.choice(magnitudes.shape[0], size=magnitudes.shape[0])
+        fmd_values.append(calc_fmd_stats_with_mc(magnitudes[sample]))
+
+    if key is not None:
+        cache.store(key, {'fmd_values': np.array(fmd_values, dtype=np.float64)}, cache_dir, max_bytes)
     return fmd_values
 
-def get_catalog_shifted_by_location_normal_error(df):
+def get_catalog_shifted_by_location_normal_error(df, random_state=np.random):
     """
     shifts catalog dataframe locations by errors assuming a
     normal distribution
 
     :param df: catalog dataframe
-    :type df: pandas.dataframe
+    :type df: pandas.dataframe or catalog.Catalog
+    :param random_state: source of the random shifts
+    :type random_state: numpy.random.RandomState
     :return: shifted catalog dataframe
-    :rtype: pandas.dataframe
+    :rtype: pandas.dataframe or catalog.Catalog
     """
-    err_df = df.copy()
-    err_df['hz_err_deg'] = err_df['horizontal_error'] / 111.113
-    err_df['lon'] = np.random.normal(err_df['lon'].values, err_df['hz_err_deg'].values+0.001)
-    err_df['lat'] = np.random.normal(err_df['lat'].values, err_df['hz_err_deg'].values+0.001)
-    return err_df
+    # item access raises KeyError on a Catalog without errors too
+    hz_err_deg = np.asarray(df['horizontal_error'], dtype=np.float64) / 111.113
+    return catalog.assign(df, hz_err_deg=hz_err_deg
+                          , lon=random_state.normal(np.asarray(df.lon), hz_err_deg + 0.001)
+                          , lat=random_state.normal(np.asarray(df.lat), hz_err_deg + 0.001))
 
 
-def calculate_b_value_parameter_sweep(dataframe, location, n_iterations, parameters):
+def calculate_b_value_parameter_sweep(dataframe, location, n_iterations, parameters
+                                      , seed=None, cache_dir=None, max_bytes=cache.DEFAULT_MAX_BYTES):
     """
     calculates grid search data for fmd statistics
 
-    dataframe : pandas.DataFrame
+    when seed and cache_dir are given every (radius, start_time) cell is
+    memoized separately, so re-running a sweep with extra cells only
+    computes the missing ones. each cell draws from its own random state
+    derived from seed, which makes a cell's result independent of the
+    other cells in parameters.
+
+    dataframe : pandas.DataFrame or catalog.Catalog
     location : list
     n_iterations : int
     parameters : list
+    seed : int
+    cache_dir : str
+    max_bytes : int
     return : pandas.DataFrame    
     """
+    use_cache = cache_dir is not None and seed is not None
+    if use_cache:
+        catalog_hash = cache.hash_catalog(dataframe, ['lon', 'lat', 'mag', 'horizontal_error'])
+
     rows = []
     for r, t in parameters:
-        raw_df = dataframe.loc[dataframe.index >= t].copy()
-        raw_df = polygon_selection.get_node_data(data=raw_df, radius=r, node=location, m=1)
+        # equal parameters of different types share keys and seeds
+        cell = (float(r), None if t is None else pd.Timestamp(t).value)
+        key = None
+        if use_cache:
+            key = cache.make_key('calculate_b_value_parameter_sweep', catalog_hash
+                                 , [float(v) for v in location], int(n_iterations), cell, int(seed))
+            cached = cache.load(key, cache_dir)
+            if cached is not None:
+                rows.append((r,) + (t,) + tuple(cached['row']))
+                continue
+
+        cell_seed = None if seed is None else int(cache.make_key(int(seed), cell)[:8], 16)
+        random_state = _random_state(cell_seed)
+
+        raw_df = catalog.time_slice(dataframe, start=t)
+        raw_df = get_catalog_events.get_node_data(data=raw_df, radius=r, node=location, m=1)
 
         try:
-            b = calc_bootstrapped_fmd_values(get_catalog_shifted_by_location_normal_error(raw_df)
-                                                   , n_iterations)
+            shifted_df = get_catalog_shifted_by_location_normal_error(raw_df, random_state)
+            b = calc_bootstrapped_fmd_values(shifted_df, n_iterations, seed=random_state.randint(2 ** 31))
             bdf = pd.DataFrame(np.array(b), columns=['a', 'b', 'bstd', 'n', 'mc'])
-            row = [(r,), (t,), bdf.mean().values, bdf.std().values]
-            row = np.concatenate(np.array(row))
+            values = np.concatenate([bdf.mean().values, bdf.std().values])
 
         except ValueError:
-            row = (r,) + (t,) + (np.nan,) * 10
+            values = np.full(10, np.nan)
 
-        rows.append(row)
+        if key is not None:
+            cache.store(key, {'row': values}, cache_dir, max_bytes)
+        rows.append((r,) + (t,) + tuple(values))
 
     bdf = pd.DataFrame(rows, columns=['radius', 'start_time', 'a_avg', 'b_avg', 'bstd_avg', 'n_avg', 'mc_avg'
         , 'a_std', 'b_std', 'bstd_std', 'n_std', 'mc_std'])